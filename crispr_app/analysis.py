@@ -1,7 +1,29 @@
 from Bio.Seq import Seq
 from difflib import Differ
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 
+try:
+    import ahocorasick
+except ImportError:  # optional; falls back to one str.find per guide
+    ahocorasick = None
+
+_IUPAC = "ACGTRYSWKMBDHVN"
+_COMPLEMENT = np.arange(256, dtype=np.uint8)
+_COMPLEMENT[np.frombuffer(_IUPAC.encode(), dtype=np.uint8)] = np.frombuffer(
+    str(Seq(_IUPAC).complement()).encode(), dtype=np.uint8
+)
+
+def encode_dna(dna_seq, strip=" \n"):
+    # Upper-cased sequence as one uint8 buffer; already-encoded input passes through
+    if isinstance(dna_seq, np.ndarray):
+        return dna_seq
+    seq = dna_seq.upper()
+    for ch in strip:
+        seq = seq.replace(ch, "")
+    return np.frombuffer(seq.encode("ascii", "replace"), dtype=np.uint8)
+
 def hybrid_score(guide, off_target_count=0):
     gc = (guide.count('G') + guide.count('C')) / len(guide)
     seed = guide[-4:]
@@ -39,84 +61,195 @@ def ml_gRNA_score(guide):
     score = max(0.0, min(score, 1.0))  # Clamp between 0.0 and 1.0
     return round(score, 3)
 
+def _guide_matrix(guides):
+    # Equal-length guides as a G x L uint8 matrix, or None if lengths differ
+    guides = list(guides)
+    if not guides or len({len(g) for g in guides}) != 1:
+        return None
+    buf = "".join(guides).encode()
+    return np.frombuffer(buf, dtype=np.uint8).reshape(len(guides), len(guides[0]))
+
+def _has_run(mat, base, run=4):
+    hits = mat == ord(base)
+    windows = hits[:, :mat.shape[1] - run + 1].copy()
+    for k in range(1, run):
+        windows &= hits[:, k:mat.shape[1] - run + 1 + k]
+    return windows.any(axis=1)
+
+# Vectorized hybrid_score: one numpy pass per rule instead of G Python calls
+def hybrid_score_batch(guides, off_target_counts=None):
+    mat = _guide_matrix(guides)
+    if mat is None:
+        counts = off_target_counts if off_target_counts is not None else [0] * len(guides)
+        return np.array([hybrid_score(g, c) for g, c in zip(guides, counts)], dtype=float)
+    gc = ((mat == ord("G")) | (mat == ord("C"))).mean(axis=1)
+    seed = mat[:, -4:]
+    seed_at = ((seed == ord("T")) | (seed == ord("A"))).sum(axis=1)
+    score = np.ones(len(mat))
+    score -= 0.2 * ((gc < 0.4) | (gc > 0.7))
+    score -= 0.1 * (_has_run(mat, "T") | _has_run(mat, "G"))
+    score -= 0.1 * (seed_at > 2)
+    score += 0.05 * (mat[:, -1] == ord("G"))
+    if off_target_counts is not None:
+        score -= 0.05 * np.asarray(off_target_counts)
+    return np.round(np.clip(score, 0.0, 1.0), 3)
+
+# Vectorized ml_gRNA_score, same rules as the scalar version
+def ml_gRNA_score_batch(guides):
+    mat = _guide_matrix(guides)
+    if mat is None:
+        return np.array([ml_gRNA_score(g) for g in guides], dtype=float)
+    gc = ((mat == ord("G")) | (mat == ord("C"))).mean(axis=1)
+    seed = mat[:, -4:]
+    seed_at = ((seed == ord("T")) | (seed == ord("A"))).sum(axis=1)
+    score = np.full(len(mat), 0.5)
+    score += np.where(
+        (0.40 < gc) & (gc < 0.60),
+        0.2,
+        np.where(((0.35 < gc) & (gc <= 0.40)) | ((0.60 <= gc) & (gc < 0.65)), 0.1, 0.0),
+    )
+    score += 0.1 * (seed_at <= 1)
+    for b in "ATCG":
+        score -= 0.1 * _has_run(mat, b)
+    score += 0.05 * (mat[:, -1] == ord("G"))
+    score -= 0.05 * (mat[:, 0] == ord("T"))
+    return np.round(np.clip(score, 0.0, 1.0), 3)
+
+# Allowed bases per PAM position (N positions omitted); shared by check_pam
+# and the vectorized _pam_mask so both always support the same PAMs
+_PAM_RULES = {
+    "NGG": {1: "G", 2: "G"},
+    "NAG": {1: "A", 2: "G"},
+    "TTTV": {0: "T", 1: "T", 2: "T", 3: "ACG"},
+}
+
 def check_pam(pam_seq, pam):
-    if pam == "NGG":
-        return pam_seq[1:] == "GG"
-    elif pam == "NAG":
-        return pam_seq[1:] == "AG"
-    elif pam == "TTTV":
-        return pam_seq[:3] == "TTT" and pam_seq[3] in "ACG"
-    return False
+    rules = _PAM_RULES.get(pam)
+    if rules is None or len(pam_seq) != len(pam):
+        return False
+    return all(pam_seq[i] in bases for i, bases in rules.items())
+
+def _pam_mask(sites, pam):
+    # Vectorized check_pam over a W x len(pam) matrix of candidate PAM sites
+    mask = np.full(len(sites), pam in _PAM_RULES)
+    for i, bases in _PAM_RULES.get(pam, {}).items():
+        mask &= np.isin(sites[:, i], list(bases.encode()))
+    return mask
+
+def _scan_strand(seq_u8, pam, guide_length, min_gc, max_gc):
+    # Start offsets and GC% of every window passing the PAM, GC and TTTT filters
+    n = len(seq_u8) - guide_length - len(pam) + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    hit = _pam_mask(sliding_window_view(seq_u8[guide_length:], len(pam))[:n], pam)
+    gc_cum = np.concatenate(([0], np.cumsum((seq_u8 == ord("G")) | (seq_u8 == ord("C")))))
+    gc = (gc_cum[guide_length:guide_length + n] - gc_cum[:n]) / guide_length * 100
+    hit &= (min_gc <= gc) & (gc <= max_gc)
+    if guide_length >= 4:
+        t = seq_u8 == ord("T")
+        t4_cum = np.concatenate(([0], np.cumsum(t[:-3] & t[1:-2] & t[2:-1] & t[3:])))
+        hit &= t4_cum[guide_length - 3:guide_length - 3 + n] == t4_cum[:n]
+    pos = np.flatnonzero(hit)
+    return pos, gc[pos]
 
 def find_gRNAs(dna_seq, pam="NGG", guide_length=20, min_gc=40, max_gc=70, add_5prime_g=False):
-    sequence = dna_seq.upper().replace("\n", "").replace(" ", "")
+    seq_u8 = encode_dna(dna_seq)
+    rc_u8 = _COMPLEMENT[seq_u8[::-1]]
     pam_len = len(pam)
     guides = []
-    for i in range(len(sequence) - guide_length - pam_len + 1):
-        guide = sequence[i:i+guide_length]
-        pam_seq = sequence[i+guide_length:i+guide_length+pam_len]
-        if check_pam(pam_seq, pam):
-            gc = (guide.count('G') + guide.count('C')) / guide_length * 100
-            if min_gc <= gc <= max_gc and "TTTT" not in guide:
-                # U6 promoter option: Add G at 5' end if not present
-                if add_5prime_g and not guide.startswith("G"):
-                    guide = "G" + guide[:-1]
-                guides.append({
-                    "Strand": "+",
-                    "Start": i,
-                    "gRNA": guide,
-                    "PAM": pam_seq,
-                    "GC%": round(gc,2),
-                })
-    rc_sequence = str(Seq(sequence).reverse_complement())
-    for i in range(len(rc_sequence) - guide_length - pam_len + 1):
-        guide = rc_sequence[i:i+guide_length]
-        pam_seq = rc_sequence[i+guide_length:i+guide_length+pam_len]
-        if check_pam(pam_seq, pam):
-            gc = (guide.count('G') + guide.count('C')) / guide_length * 100
-            if min_gc <= gc <= max_gc and "TTTT" not in guide:
-                if add_5prime_g and not guide.startswith("G"):
-                    guide = "G" + guide[:-1]
-                guides.append({
-                    "Strand": "-",
-                    "Start": len(sequence)-i-guide_length-pam_len,
-                    "gRNA": guide,
-                    "PAM": pam_seq,
-                    "GC%": round(gc,2),
-                })
-    return pd.DataFrame(guides)
+    for strand, strand_u8 in (("+", seq_u8), ("-", rc_u8)):
+        sequence = strand_u8.tobytes().decode()
+        for i, gc in zip(*_scan_strand(strand_u8, pam, guide_length, min_gc, max_gc)):
+            i = int(i)
+            guide = sequence[i:i+guide_length]
+            pam_seq = sequence[i+guide_length:i+guide_length+pam_len]
+            # U6 promoter option: Add G at 5' end if not present
+            if add_5prime_g and not guide.startswith("G"):
+                guide = "G" + guide[:-1]
+            guides.append({
+                "Strand": strand,
+                "Start": i if strand == "+" else len(sequence)-i-guide_length-pam_len,
+                "gRNA": guide,
+                "PAM": pam_seq,
+                "GC%": round(float(gc),2),
+            })
+    df = pd.DataFrame(guides)
+    if not df.empty:
+        # Arrow-backed strings: contiguous buffers instead of per-cell PyObjects
+        df[["gRNA", "PAM"]] = df[["gRNA", "PAM"]].astype("string[pyarrow]")
+    return df
+
+# 2-bit nucleotide codes; anything that isn't ACGT maps to 255
+_CODE = np.full(256, 255, dtype=np.uint8)
+_CODE[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+_LOW_BITS = np.uint64(0x5555555555555555)
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount(x):
+    if hasattr(np, "bitwise_count"):  # NumPy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(len(x), 8).sum(axis=1)
+
+def _pack_windows(codes, length):
+    # Every length-nt window of a 2-bit code array packed into one uint64
+    n = len(codes) - length + 1
+    packed = np.zeros(n, dtype=np.uint64)
+    for k in range(length):
+        packed <<= np.uint64(2)
+        packed |= codes[k:k + n]
+    return packed
+
+def _window_mismatches(bg_u8, guide, packed_cache):
+    # Hamming distance of guide against every window of bg_u8
+    guide_u8 = np.frombuffer(guide.encode(), dtype=np.uint8)
+    guide_codes = _CODE[guide_u8]
+    if len(guide) > 32 or (guide_codes == 255).any():
+        return (sliding_window_view(bg_u8, len(guide)) != guide_u8).sum(axis=1)
+    if len(guide) not in packed_cache:
+        bg_codes = _CODE[bg_u8]
+        invalid = bg_codes == 255
+        packed_cache[len(guide)] = (
+            _pack_windows(np.where(invalid, 0, bg_codes).astype(np.uint64), len(guide)),
+            _pack_windows(invalid.astype(np.uint64), len(guide)),
+        )
+    packed, invalid_packed = packed_cache[len(guide)]
+    x = packed ^ _pack_windows(guide_codes.astype(np.uint64), len(guide))[0]
+    # One low bit per differing base; non-ACGT background bases always mismatch
+    return _popcount(((x | (x >> np.uint64(1))) & _LOW_BITS) | invalid_packed)
 
 def find_off_targets_detailed(guides, background_seq, max_mismatches=2):
-    results = []
-    bg_seq = background_seq.upper().replace('\n', '')[:1_000_000]
-    for _, row in guides.iterrows():
-        guide = row["gRNA"]
-        details = []
-        for i in range(len(bg_seq) - len(guide) + 1):
-            window = bg_seq[i:i+len(guide)]
-            mismatches = sum(1 for a, b in zip(guide, window) if a != b)
-            if mismatches <= max_mismatches:
-                details.append({
-                    "Position": i,
-                    "Mismatches": mismatches,
-                    "Sequence": window
-                })
-        results.append({
-            "gRNA": guide,
-            "OffTargetCount": len(details),
-            "Details": details
-        })
+    bg_u8 = encode_dna(background_seq, strip="\n")[:1_000_000]
+    bg_seq = bg_u8.tobytes().decode()
+    packed_cache = {}
     flat = []
-    for result in results:
-        for detail in result["Details"]:
+    for guide in guides.get("gRNA", ()):
+        if not guide or len(guide) > len(bg_u8):
+            continue
+        mismatches = _window_mismatches(bg_u8, guide, packed_cache)
+        for i in np.flatnonzero(mismatches <= max_mismatches):
             flat.append({
-                "gRNA": result["gRNA"],
-                "OffTargetPos": detail["Position"],
-                "Mismatches": detail["Mismatches"],
-                "TargetSeq": detail["Sequence"]
+                "gRNA": guide,
+                "OffTargetPos": int(i),
+                "Mismatches": int(mismatches[i]),
+                "TargetSeq": bg_seq[i:i+len(guide)]
             })
     return pd.DataFrame(flat)
 
+def find_guide_offsets(seq, guides):
+    # First offset of each guide in seq (-1 if absent), in a single Aho-Corasick pass
+    guides = list(dict.fromkeys(guides))
+    if ahocorasick is None or not guides:
+        return {g: seq.find(g) for g in guides}
+    automaton = ahocorasick.Automaton()
+    for g in guides:
+        automaton.add_word(g, g)
+    automaton.make_automaton()
+    offsets = dict.fromkeys(guides, -1)
+    for end, g in automaton.iter(seq):
+        if offsets[g] == -1:
+            offsets[g] = end - len(g) + 1
+    return offsets
+
 def safe_translate(seq):
     extra = len(seq) % 3
     if extra != 0:
@@ -1,20 +1,120 @@
+import concurrent.futures
+import hashlib
+import io
+import threading
+import traceback
+
+import matplotlib.pyplot as plt
 import streamlit as st
 import pandas as pd
 from utils import (
     validate_sequence,
     load_fasta,
+    visualize_guide_location,
 )
 from analysis import (
+    encode_dna,
     find_gRNAs,
     find_off_targets_detailed,
+    find_guide_offsets,
     simulate_protein_edit,
     diff_proteins,
     indel_simulations,
-    predict_hdr_repair,
-    hybrid_score,
-    ml_gRNA_score,
+    hybrid_score_batch,
+    ml_gRNA_score_batch,
 )
 
+pd.options.future.infer_string = True
+
+def _digest(text):
+    # Explicit cache key so Streamlit doesn't re-hash multi-MB sequences/prompts itself
+    return hashlib.sha1(text.encode()).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_fasta_cached(content):
+    return load_fasta(io.BytesIO(content))
+
+@st.cache_resource(max_entries=4)
+def _encoded_dna(seq_digest, _seq, strip=" \n"):
+    # Read-only uint8 buffer, shared by every scan of the same sequence
+    return encode_dna(_seq, strip=strip)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _cached_find_gRNAs(seq_digest, _seq_u8, pam, guide_len, min_gc, max_gc):
+    return find_gRNAs(_seq_u8, pam, guide_len, min_gc, max_gc)
+
+@st.cache_resource
+def _executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+def _scan_not_failed(fut):
+    return not (fut.done() and fut.exception() is not None)
+
+# A failed Future fails validation, so only that entry is resubmitted on the next hit
+@st.cache_resource(max_entries=8, validate=_scan_not_failed)
+def _submit_off_target_scan(guides, bg_digest, _bg_u8, max_mm):
+    # Scan off the script thread; identical inputs share one Future, so a
+    # finished scan is reused like a cache hit
+    return _executor().submit(
+        find_off_targets_detailed, pd.DataFrame({"gRNA": list(guides)}), _bg_u8, max_mm
+    )
+
+@st.cache_data(show_spinner=False)
+def _guide_offsets(seq_digest, _seq, guides):
+    # Upper-case once and locate every guide, instead of per tab and per rerun
+    return find_guide_offsets(_seq.upper(), guides)
+
+@st.cache_resource
+def _pyplot_lock():
+    # pyplot keeps global state, so renders from concurrent sessions take turns
+    return threading.Lock()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_vis_png(seq_digest, gRNA, idx, _seq):
+    # Render once to PNG bytes and close the figure so pyplot doesn't keep it alive
+    with _pyplot_lock():
+        fig = visualize_guide_location(_seq, gRNA, idx).figure
+        try:
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", bbox_inches="tight")
+        finally:
+            plt.close(fig)
+    return buf.getvalue()
+
+# One client object per key; credentials never go through SDK-wide globals,
+# so concurrent sessions can't pick up each other's key
+@st.cache_resource
+def _get_gemini(api_key):
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+@st.cache_resource
+def _get_openai(api_key):
+    import openai
+    return openai.OpenAI(api_key=api_key)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _ai_generate(backend, model, prompt_digest, _prompt, api_key):
+    # Identical prompts return the stored text instead of another API round trip
+    if backend == "Gemini":
+        result = _get_gemini(api_key).models.generate_content(model=model, contents=_prompt)
+        return result.text if hasattr(result, "text") else str(result)
+    resp = _get_openai(api_key).chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a CRISPR genome editing expert."},
+            {"role": "user", "content": _prompt},
+        ],
+    )
+    return resp.choices[0].message.content
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _df_to_csv(df):
+    # Bytes, so download_button doesn't re-encode on every rerun
+    return df.to_csv(index=False).encode()
+
+OPENAI_MODEL = "gpt-3.5-turbo"
+
 SCORE_SUMMARY = """
 #### Understanding the Scores
 
@@ -62,7 +162,7 @@ with st.sidebar:
     uploaded = st.file_uploader("Upload .fasta", type=["fasta", "fa", "txt"])
     dna_seq = st.text_area("Or paste DNA sequence:", height=150, key="dna_seq")
     if uploaded:
-        seq, err = load_fasta(uploaded)
+        seq, err = _load_fasta_cached(uploaded.getvalue())
         if err:
             st.error(err)
         else:
@@ -116,14 +216,21 @@ with st.sidebar:
 
 for k in (
     "df_guides",
+    "df_guides_sig",
+    "scored_sig",
     "offtargets",
+    "offtarget_future",
     "guide_scores",
+    "rank_df",
+    "offtarget_summary",
     "selected_gRNA",
     "selected_edit",
     "sim_result",
     "sim_indel",
     "ai_response",
+    "ai_response_error",
     "gemini_report",
+    "gemini_report_error",
 ):
     st.session_state.setdefault(k, None)
 
@@ -146,16 +253,24 @@ if st.button("🔍 Find gRNAs"):
         st.session_state.df_guides = None
     else:
         with st.spinner("Searching gRNAs…"):
-            st.session_state.df_guides = find_gRNAs(
-                dna_seq, pam, guide_len, min_gc, max_gc
+            dna_digest = _digest(dna_seq)
+            st.session_state.df_guides = _cached_find_gRNAs(
+                dna_digest, _encoded_dna(dna_digest, dna_seq), pam, guide_len, min_gc, max_gc
             )
         st.session_state.update(
+            df_guides_sig=hash(tuple(st.session_state.df_guides.get("gRNA", ()))),
+            scored_sig=None,
             offtargets=None,
+            offtarget_future=None,
             guide_scores=None,
+            rank_df=None,
+            offtarget_summary=None,
             sim_result=None,
             sim_indel=None,
             ai_response="",
+            ai_response_error=None,
             gemini_report=None,
+            gemini_report_error=None,
         )
 
 df = st.session_state.df_guides
@@ -163,103 +278,152 @@ if df is None or df.empty:
     st.info("Paste DNA & click **Find gRNAs** to begin.")
     st.stop()
 
-if "HybridScore" not in df.columns or "MLScore" not in df.columns or "ConsensusScore" not in df.columns:
-    df["HybridScore"] = [hybrid_score(g) for g in df.gRNA]
-    df["MLScore"] = [ml_gRNA_score(g) for g in df.gRNA]
+# Only score a freshly searched table; later reruns reuse the stored columns
+if st.session_state.scored_sig != st.session_state.df_guides_sig:
+    df["HybridScore"] = hybrid_score_batch(df.gRNA)
+    df["MLScore"] = ml_gRNA_score_batch(df.gRNA)
     df["ConsensusScore"] = ((df["HybridScore"] + df["MLScore"]) / 2).clip(upper=1.0)
+    df = df.sort_values("ConsensusScore", ascending=False, kind="stable").reset_index(drop=True)
+    st.session_state.df_guides = df
+    st.session_state.scored_sig = st.session_state.df_guides_sig
+
+dna_digest = _digest(dna_seq)
+guide_offsets = _guide_offsets(dna_digest, dna_seq, tuple(df.gRNA))
 
 u6_toggle = st.session_state.get("u6_g_toggle", False)
 df_display = apply_u6_toggle_to_df(df, u6_toggle)
 
 st.success(f"✅ {len(df_display)} gRNAs found")
 st.dataframe(df_display, use_container_width=True)
-st.download_button("⬇️ Download gRNAs CSV", df_display.to_csv(index=False), "guides.csv")
+st.download_button("⬇️ Download gRNAs CSV", _df_to_csv(df_display), "guides.csv", mime="text/csv")
 
 st.markdown("---")
 st.header("📄 One Click Gemini Report")
 
-def build_gemini_prompt():
-    context_parts = [
-        SCORE_SUMMARY,
-        "### Score Logic Explanation (for AI only)\n",
-        SCORE_EXPLAIN,
+AI_INSTRUCTIONS = (
+    "\n\nSummarize the above results for a CRISPR scientist, highlighting: "
+    "1. Which guides have the highest reliability and why. "
+    "2. Any off-target risks. "
+    "3. Editing simulation impact. "
+    "4. Additional tips for experiment design."
+)
+
+def _frame_sig(frame):
+    # Content signature, so the cache key doesn't depend on frame identity
+    if frame is None:
+        return None
+    return hash(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_ai_context(score_parts, table_sig, summary_sig, sim_res, _table, _summary):
+    context_parts = list(score_parts) + [
         "\n\n### gRNA Candidates Table (top 10 shown)\n",
-        df_display[["gRNA", "HybridScore", "MLScore", "ConsensusScore"]].head(10).to_csv(sep="|", index=False),
+        _table.to_csv(sep="|", index=False),
     ]
-    ot_df = st.session_state.offtargets
-    if ot_df is not None and not ot_df.empty and "gRNA" in ot_df.columns and "Mismatches" in ot_df.columns:
-        off_target_summary = ot_df.groupby("gRNA")["Mismatches"].count().reset_index()
+    if _summary is not None:
         context_parts.append("\n\n### Off-target Summary\n")
-        context_parts.append(off_target_summary.to_csv(sep="|", index=False))
-    sim_res = st.session_state.sim_result
+        context_parts.append(_summary.to_csv(sep="|", index=False))
     if sim_res:
         before, after, fs, stop = sim_res
         context_parts.append("\n\n### Simulation Result\n")
         context_parts.append(f"Before protein: {before}\n")
         context_parts.append(f"After protein: {after}\n")
         context_parts.append(f"Frameshift: {fs} | Premature stop: {stop}\n")
-    context_str = "\n".join(context_parts)
-    prompt = (
-        context_str
-        + "\n\nSummarize the above results for a CRISPR scientist, highlighting: "
-          "1. Which guides have the highest reliability and why. "
-          "2. Any off-target risks. "
-          "3. Editing simulation impact. "
-          "4. Additional tips for experiment design."
+    return "\n".join(context_parts)
+
+# Shared by the Gemini report and AI Explain tab; rebuilt only when its inputs change
+def build_ai_context(score_parts):
+    table = df_display[["gRNA", "HybridScore", "MLScore", "ConsensusScore"]].head(10)
+    off_target_summary = st.session_state.offtarget_summary
+    return _cached_ai_context(
+        tuple(score_parts),
+        _frame_sig(table),
+        _frame_sig(off_target_summary),
+        st.session_state.sim_result,
+        table,
+        off_target_summary,
     )
-    return prompt
-
-if st.button("📄 Generate Gemini Report"):
-    ai_backend = st.session_state.get("ai_backend_sidebar", "Gemini")
-    api_key = st.session_state.get("api_key_sidebar", "")
-    gemini_model = st.session_state.get("gemini_model_sidebar", "gemini-1.5-flash-latest")
-    if not api_key or len(api_key.strip()) < 10:
-        st.error("Enter a valid API key in the sidebar.")
+
+def report_ai_error(e, target):
+    error_str = str(e)
+    # FRIENDLY Gemini error reporting
+    if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
+        st.error("❌ Your Gemini API key is invalid or this model is not enabled for your account/project. Please double-check your key and model selection.")
+    elif "model not found" in error_str or "not supported" in error_str:
+        st.error("❌ The selected Gemini model is not available. Try selecting 'gemini-pro' in the sidebar.")
     else:
-        prompt = build_gemini_prompt()
-        try:
-            if ai_backend == "Gemini":
-                import google.generativeai as genai
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(gemini_model)
-                result = model.generate_content(prompt)
-                st.session_state.gemini_report = result.text if hasattr(result, "text") else str(result)
-            else:
-                import openai
-                openai.api_key = api_key
-                resp = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a CRISPR genome editing expert."},
-                        {"role": "user", "content": prompt},
-                    ],
-                )
-                st.session_state.gemini_report = resp.choices[0].message.content
-        except Exception as e:
-            error_str = str(e)
-            # FRIENDLY Gemini error reporting
-            if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
-                st.error("❌ Your Gemini API key is invalid or this model is not enabled for your account/project. Please double-check your key and model selection.")
-            elif "model not found" in error_str or "not supported" in error_str:
-                st.error("❌ The selected Gemini model is not available. Try selecting 'gemini-pro' in the sidebar.")
-            else:
-                st.error(f"Gemini API error: {error_str}")
-            st.session_state.gemini_report = ""
+        st.error(f"API error: {type(e).__name__}: {error_str}")
+    st.session_state[target] = ""
+    # Frame-free snapshot: doesn't keep the prompt, SDK objects or runner frames
+    # alive, and is only formatted on request
+    st.session_state[f"{target}_error"] = traceback.TracebackException.from_exception(
+        e, lookup_lines=False
+    )
 
-if st.session_state.gemini_report:
-    st.subheader("Gemini AI Report")
-    st.info(st.session_state.gemini_report)
+def show_ai_traceback(target):
+    err = st.session_state.get(f"{target}_error")
+    if err is not None and st.checkbox("Show full traceback", key=f"{target}_traceback"):
+        st.code("".join(err.format()))
 
-tab_ot, tab_sim, tab_ai, tab_rank = st.tabs(
-    ["Off-targets", "Simulation & Indel", "AI Explain", "Ranking"]
+def build_gemini_prompt():
+    context_str = build_ai_context(
+        [SCORE_SUMMARY, "### Score Logic Explanation (for AI only)\n", SCORE_EXPLAIN]
+    )
+    return context_str + AI_INSTRUCTIONS
+
+@st.fragment
+def _gemini_report_fragment():
+    if st.button("📄 Generate Gemini Report"):
+        ai_backend = st.session_state.get("ai_backend_sidebar", "Gemini")
+        api_key = st.session_state.get("api_key_sidebar", "")
+        gemini_model = st.session_state.get("gemini_model_sidebar", "gemini-1.5-flash-latest")
+        if not api_key or len(api_key.strip()) < 10:
+            st.error("Enter a valid API key in the sidebar.")
+        else:
+            prompt = build_gemini_prompt()
+            try:
+                model = gemini_model if ai_backend == "Gemini" else OPENAI_MODEL
+                st.session_state.gemini_report = _ai_generate(
+                    ai_backend, model, _digest(prompt), prompt, api_key
+                )
+                st.session_state.gemini_report_error = None
+            except Exception as e:
+                report_ai_error(e, "gemini_report")
+    show_ai_traceback("gemini_report")
+
+    if st.session_state.gemini_report:
+        st.subheader("Gemini AI Report")
+        st.info(st.session_state.gemini_report)
+_gemini_report_fragment()
+
+# Tab bodies with their own widgets run as fragments, so interacting with one
+# tab reruns just that tab instead of the whole script
+tab_ot, tab_sim, tab_vis, tab_ai, tab_rank = st.tabs(
+    ["Off-targets", "Simulation & Indel", "Visualization", "AI Explain", "Ranking"]
 )
 
 with tab_ot:
     if not bg_seq.strip():
         st.info("Provide background DNA in sidebar for off-target scanning.")
     else:
+        @st.fragment(run_every=1)
+        def _poll_off_target_scan():
+            st.status("Scanning off-targets…", state="running")
+            fut = st.session_state.offtarget_future
+            if fut is None or fut.done():
+                st.rerun()
+
         if st.button("Scan off-targets"):
-            result_from_find = find_off_targets_detailed(df, bg_seq, max_mm)
+            bg_digest = _digest(bg_seq)
+            st.session_state.offtarget_future = _submit_off_target_scan(
+                tuple(df.gRNA), bg_digest, _encoded_dna(bg_digest, bg_seq, strip="\n"), max_mm
+            )
+        fut = st.session_state.offtarget_future
+        if fut is not None and not fut.done():
+            _poll_off_target_scan()
+        elif fut is not None:
+            st.session_state.offtarget_future = None
+            result_from_find = fut.result()
             # handle series case
             if isinstance(result_from_find, pd.Series):
                 ot_df = result_from_find.to_frame().T
@@ -270,19 +434,26 @@ with tab_ot:
 
             # SAFETY: Only score if right columns exist!
             scores = {}
+            offtarget_summary = None
             if ot_df is not None and not ot_df.empty and "gRNA" in ot_df.columns and "Mismatches" in ot_df.columns:
-                for g in df.gRNA:
-                    subset = ot_df[ot_df["gRNA"] == g]
-                    if subset.empty:
-                        scores[g] = 1.0
-                    else:
-                        scores[g] = round(1.0 / (1 + subset["Mismatches"].sum()), 3)
+                # One groupby pass instead of masking ot_df once per guide
+                per_guide = ot_df.groupby("gRNA")["Mismatches"].agg(Count="size", MMSum="sum")
+                specificity = (1.0 / (1 + per_guide["MMSum"].reindex(df.gRNA.unique()))).fillna(1.0)
+                # Series.round uses NumPy rounding, as the per-guide np.float64 round did
+                scores = specificity.round(3).to_dict()
+                offtarget_summary = per_guide["Count"].rename("Mismatches").reset_index()
             else:
                 # All 1.0 if no off-targets or missing columns
                 scores = {g: 1.0 for g in df.gRNA}
                 if ot_df is not None and not ot_df.empty:
                     st.error("Off-target results missing required columns ('gRNA', 'Mismatches').")
             st.session_state.guide_scores = scores
+            st.session_state.rank_df = (
+                pd.DataFrame({"gRNA": list(scores), "Specificity": list(scores.values())})
+                .sort_values("Specificity", ascending=False, kind="stable")
+                .reset_index(drop=True)
+            )
+            st.session_state.offtarget_summary = offtarget_summary
 
         ot_df = st.session_state.offtargets
         if ot_df is not None:
@@ -292,8 +463,9 @@ with tab_ot:
                 st.dataframe(ot_df, use_container_width=True)
                 st.download_button(
                     "⬇️ Download off-targets",
-                    ot_df.to_csv(index=False),
+                    _df_to_csv(ot_df),
                     "offtargets.csv",
+                    mime="text/csv",
                 )
 
 with tab_sim:
@@ -308,127 +480,97 @@ with tab_sim:
     )
     gRNA_for_analysis = gRNA_display_to_seq[st.session_state.selected_gRNA]
 
-    EDIT_TYPES = {
-        "Delete 1 bp": "del1",
-        "Insert A": "insA",
-        "Delete 3 bp": "del3",
-        "Insert G": "insG",
-        "Substitute A→T": "subAG",
-    }
-    st.session_state.selected_edit = st.selectbox(
-        "Edit type", list(EDIT_TYPES), key="sel_edit"
-    )
-    sub_from = sub_to = ""
-    if EDIT_TYPES[st.session_state.selected_edit] == "subAG":
-        sub_from = st.text_input("Sub FROM", "A")
-        sub_to = st.text_input("Sub TO", "T")
-
-    if st.button("Simulate"):
-        idx = dna_seq.upper().find(gRNA_for_analysis)
+    @st.fragment
+    def _sim_fragment(gRNA_for_analysis):
+        EDIT_TYPES = {
+            "Delete 1 bp": "del1",
+            "Insert A": "insA",
+            "Delete 3 bp": "del3",
+            "Insert G": "insG",
+            "Substitute A→T": "subAG",
+        }
+        st.session_state.selected_edit = st.selectbox(
+            "Edit type", list(EDIT_TYPES), key="sel_edit"
+        )
+        sub_from = sub_to = ""
+        if EDIT_TYPES[st.session_state.selected_edit] == "subAG":
+            sub_from = st.text_input("Sub FROM", "A")
+            sub_to = st.text_input("Sub TO", "T")
+
+        if st.button("Simulate"):
+            idx = guide_offsets[gRNA_for_analysis]
+            if idx == -1:
+                st.error("gRNA not found in sequence!")
+            else:
+                st.session_state.sim_result = simulate_protein_edit(
+                    dna_seq,
+                    idx + edit_offset,
+                    EDIT_TYPES[st.session_state.selected_edit],
+                    sub_from=sub_from,
+                    sub_to=sub_to,
+                )
+                st.session_state.sim_indel = indel_simulations(
+                    dna_seq, idx + edit_offset
+                )
+                # The AI context shows sim_result too, so refresh the whole app
+                st.rerun()
+
+        if st.session_state.sim_result:
+            before, after, fs, stop = st.session_state.sim_result
+            st.markdown(f"**Before protein:** `{before}`")
+            st.markdown(f"**After protein:** `{after}`")
+            st.markdown(f"**Diff:** {diff_proteins(before, after)}")
+            st.write("Frameshift:", fs, "| Premature stop:", stop)
+        if st.session_state.sim_indel is not None:
+            st.subheader("±1–3 bp indel simulation")
+            st.dataframe(st.session_state.sim_indel, use_container_width=True)
+    _sim_fragment(gRNA_for_analysis)
+
+with tab_vis:
+    # st.tabs runs every tab body, so only draw the map when asked for
+    view = st.radio("Guide map", ["Hidden", "Shown"], horizontal=True, key="vis_view")
+    if view == "Shown":
+        idx = guide_offsets[gRNA_for_analysis]
         if idx == -1:
-            st.error("gRNA not found in sequence!")
+            st.warning("gRNA not found in sequence!")
         else:
-            st.session_state.sim_result = simulate_protein_edit(
-                dna_seq,
-                idx + edit_offset,
-                EDIT_TYPES[st.session_state.selected_edit],
-                sub_from=sub_from,
-                sub_to=sub_to,
-            )
-            st.session_state.sim_indel = indel_simulations(
-                dna_seq, idx + edit_offset
-            )
-
-    if st.session_state.sim_result:
-        before, after, fs, stop = st.session_state.sim_result
-        st.markdown(f"**Before protein:** `{before}`")
-        st.markdown(f"**After protein:** `{after}`")
-        st.markdown(f"**Diff:** {diff_proteins(before, after)}")
-        st.write("Frameshift:", fs, "| Premature stop:", stop)
-    if st.session_state.sim_indel is not None:
-        st.subheader("±1–3 bp indel simulation")
-        st.dataframe(st.session_state.sim_indel, use_container_width=True)
+            st.image(_cached_vis_png(dna_digest, gRNA_for_analysis, idx, dna_seq))
 
 with tab_ai:
-    st.header("AI Explain (Gemini / OpenAI)")
-    context_parts = [
-        SCORE_EXPLAIN,
-        "\n\n### gRNA Candidates Table (top 10 shown)\n",
-        df_display[["gRNA", "HybridScore", "MLScore", "ConsensusScore"]].head(10).to_csv(sep="|", index=False),
-    ]
-    ot_df = st.session_state.offtargets
-    if ot_df is not None and not ot_df.empty and "gRNA" in ot_df.columns and "Mismatches" in ot_df.columns:
-        off_target_summary = ot_df.groupby("gRNA")["Mismatches"].count().reset_index()
-        context_parts.append("\n\n### Off-target Summary\n")
-        context_parts.append(off_target_summary.to_csv(sep="|", index=False))
-    sim_res = st.session_state.sim_result
-    if sim_res:
-        before, after, fs, stop = sim_res
-        context_parts.append("\n\n### Simulation Result\n")
-        context_parts.append(f"Before protein: {before}\n")
-        context_parts.append(f"After protein: {after}\n")
-        context_parts.append(f"Frameshift: {fs} | Premature stop: {stop}\n")
-    context_str = "\n".join(context_parts)
-    with st.expander("🔎 See full context sent to AI (for debugging)", expanded=False):
-        st.code(context_str)
-    user_notes = st.text_area(
-        "Add any specific questions or notes for AI (optional):", 
-        "", 
-        key="ai_notes"
-    )
-    prompt = (
-        context_str
-        + "\n\n"
-        + (user_notes.strip() if user_notes else "")
-        + "\n\nSummarize the above results for a CRISPR scientist, highlighting: "
-          "1. Which guides have the highest reliability and why. "
-          "2. Any off-target risks. "
-          "3. Editing simulation impact. "
-          "4. Additional tips for experiment design."
-    )
-    if st.button("Ask AI"):
-        try:
-            if ai_backend == "Gemini":
-                import google.generativeai as genai
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel(gemini_model)
-                result = model.generate_content(prompt)
-                st.session_state.ai_response = result.text if hasattr(result, "text") else str(result)
-            else:
-                import openai
-                openai.api_key = api_key
-                resp = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a CRISPR genome editing expert."},
-                        {"role": "user", "content": prompt},
-                    ],
+    @st.fragment
+    def _ai_fragment():
+        st.header("AI Explain (Gemini / OpenAI)")
+        context_str = build_ai_context([SCORE_EXPLAIN])
+        with st.expander("🔎 See full context sent to AI (for debugging)", expanded=False):
+            st.code(context_str)
+        user_notes = st.text_area(
+            "Add any specific questions or notes for AI (optional):", 
+            "", 
+            key="ai_notes"
+        )
+        prompt = (
+            context_str
+            + "\n\n"
+            + (user_notes.strip() if user_notes else "")
+            + AI_INSTRUCTIONS
+        )
+        if st.button("Ask AI"):
+            try:
+                model = gemini_model if ai_backend == "Gemini" else OPENAI_MODEL
+                st.session_state.ai_response = _ai_generate(
+                    ai_backend, model, _digest(prompt), prompt, api_key
                 )
-                st.session_state.ai_response = resp.choices[0].message.content
-        except Exception as e:
-            error_str = str(e)
-            if "API key not valid" in error_str or "API_KEY_INVALID" in error_str:
-                st.error("❌ Your Gemini API key is invalid or this model is not enabled for your account/project. Please double-check your key and model selection.")
-            elif "model not found" in error_str or "not supported" in error_str:
-                st.error("❌ The selected Gemini model is not available. Try selecting 'gemini-pro' in the sidebar.")
-            else:
-                st.error(f"Gemini API error: {error_str}")
-            st.session_state.ai_response = ""
-    if st.session_state.ai_response:
-        st.info(st.session_state.ai_response)
+                st.session_state.ai_response_error = None
+            except Exception as e:
+                report_ai_error(e, "ai_response")
+        show_ai_traceback("ai_response")
+        if st.session_state.ai_response:
+            st.info(st.session_state.ai_response)
+    _ai_fragment()
 
 with tab_rank:
     if st.session_state.guide_scores:
-        rank_df = (
-            pd.DataFrame(
-                [
-                    {"gRNA": u6_g_mod(g) if u6_toggle else g, "Specificity": s}
-                    for g, s in st.session_state.guide_scores.items()
-                ]
-            )
-            .sort_values("Specificity", ascending=False)
-            .reset_index(drop=True)
-        )
+        rank_df = apply_u6_toggle_to_df(st.session_state.rank_df, u6_toggle)
         st.dataframe(rank_df, use_container_width=True)
     else:
         st.info("Run off-target scan to get specificity ranking.")